@@ -4,8 +4,307 @@ from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse, urldefrag
 import time
 import json
+import socket
+import http.cookiejar
+import threading
+import os
+import re
+import sys
+import uuid
+import hashlib
+import math
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 import sqlite3
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # опционально, нужен для HTTP/2 (pip install httpx[http2])
+except ImportError:
+    httpx = None
+
+MAX_REDIRECTS = 30
+FETCH_ERRORS = (requests.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+_dns_cache = {}
+_dns_lock = threading.Lock()
+_dns_ttl = 0
+DNS_CACHE_SWEEP = 1024  # при таком размере кэша вычищаем все устаревшие записи
+_orig_getaddrinfo = socket.getaddrinfo
+
+def _cached_getaddrinfo(host, port, *args, **kwargs):
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    now = time.monotonic()
+    with _dns_lock:
+        entry = _dns_cache.get(key)
+        if entry:
+            if entry[0] > now:
+                return entry[1]
+            del _dns_cache[key]  # устаревшие записи удаляем, чтобы кэш не рос в режиме сервиса
+    result = _orig_getaddrinfo(host, port, *args, **kwargs)
+    with _dns_lock:
+        if len(_dns_cache) >= DNS_CACHE_SWEEP:
+            for old_key in [k for k, (expires, _) in _dns_cache.items() if expires <= now]:
+                del _dns_cache[old_key]
+        _dns_cache[key] = (now + _dns_ttl, result)
+    return result
+
+def dns_cached_hosts():
+    now = time.monotonic()
+    with _dns_lock:
+        return len({key[0] for key, (expires, _) in _dns_cache.items() if expires > now})
+
+def install_dns_cache(ttl=300):
+    # кэш резолвинга на уровне процесса, чтобы не ходить в DNS на каждый запрос
+    global _dns_ttl
+    _dns_ttl = ttl
+    socket.getaddrinfo = _cached_getaddrinfo if ttl > 0 else _orig_getaddrinfo
+
+def _counting_pool(pool_cls, on_connect):
+    # пул urllib3, соединения которого сообщают о каждом реальном connect(),
+    # в том числе о переподключении после разрыва со стороны сервера
+    class CountingConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            on_connect()
+            return super().connect()
+    return type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection})
+
+class CountingAdapter(HTTPAdapter):
+    def __init__(self, on_connect, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: _counting_pool(pool_cls, self.on_connect)
+            for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+class FetchClient:
+    def __init__(self, headers, timeout=50, pool_size=10, http2=False, dns_ttl=300):
+        self.headers = headers
+        self.timeout = timeout
+        self.http2 = http2 and httpx is not None
+        if http2 and httpx is None:
+            print("httpx не установлен, HTTP/2 недоступен - используем requests")
+        install_dns_cache(dns_ttl)
+        self.requests_count = 0
+        self.connections_count = 0  # реальные TCP-подключения
+        self._lock = threading.Lock()  # клиент общий для всех задач демона
+        # cookies не храним: иначе задачи демона влияли бы друг на друга через общий клиент
+        no_cookies = http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+        if self.http2:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            self.client = httpx.Client(http2=True, headers=headers, timeout=timeout, limits=limits,
+                                       cookies=http.cookiejar.CookieJar(policy=no_cookies))
+        else:
+            self.client = requests.Session()
+            self.client.cookies.set_policy(no_cookies)
+            self.client.headers.update(headers)
+            adapter = CountingAdapter(self._on_connect, pool_connections=pool_size, pool_maxsize=pool_size)
+            self.client.mount('http://', adapter)
+            self.client.mount('https://', adapter)
+
+    def _on_connect(self):
+        with self._lock:
+            self.connections_count += 1
+
+    def _trace(self, event_name, info):
+        # trace-расширение httpcore: считаем завершенные TCP-подключения
+        if event_name == "connection.connect_tcp.complete":
+            self._on_connect()
+
+    def fetch(self, url, timeout=None, max_size=1024*1024*2):
+        # один запрос без перехода по редиректам, timeout - свой у каждой задачи (по умолчанию клиента)
+        # возвращает (статус, абсолютный Location или None, содержимое)
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self.requests_count += 1
+        content = b''
+        if self.http2:
+            with self.client.stream('GET', url, follow_redirects=False, timeout=timeout,
+                                    extensions={"trace": self._trace}) as response:
+                for chunk in response.iter_bytes(1024*10):
+                    content += chunk
+                    if len(content) > max_size:
+                        break
+                location = response.headers.get('location') if response.has_redirect_location else None
+                return response.status_code, location and urljoin(url, location), content
+
+        response = self.client.get(url, timeout=timeout, allow_redirects=False, stream=True)
+        try:
+            for chunk in response.iter_content(1024*10):#читаем блоками по 10кб до 2мб
+                content += chunk
+                if len(content) > max_size:
+                    break
+            location = response.headers.get('location') if response.is_redirect else None
+            return response.status_code, location and urljoin(url, location), content
+        finally:
+            response.close()
+
+    def stats(self):
+        connections = self.connections_count
+        return {
+            "requests": self.requests_count,
+            "connections": connections,
+            "reused": max(self.requests_count - connections, 0),
+            "dns_cached_hosts": dns_cached_hosts(),
+            "http2": self.http2,
+        }
+
+    def close(self):
+        self.client.close()
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8  # при расстоянии <= 7 хотя бы одна 8-битная полоса совпадет точно
+SIMHASH_DISTANCE = 6
+
+def simhash(text, shingle=2, max_words=5000):
+    words = re.findall(r'\w+', text.lower())[:max_words]
+    if len(words) < shingle:
+        return None
+    weights = {}
+    for i in range(len(words) - shingle + 1):
+        digest = hashlib.blake2b(' '.join(words[i:i + shingle]).encode('utf-8'), digest_size=8).digest()
+        h = int.from_bytes(digest, 'big')
+        weights[h] = weights.get(h, 0) + 1
+    fingerprint = 0
+    for bit in range(SIMHASH_BITS):
+        mask = 1 << bit
+        if sum(w if h & mask else -w for h, w in weights.items()) > 0:
+            fingerprint |= mask
+    return fingerprint
+
+class FingerprintIndex:
+    def __init__(self):
+        band_bits = SIMHASH_BITS // SIMHASH_BANDS
+        self.band_mask = (1 << band_bits) - 1
+        self.band_bits = band_bits
+        self.bands = [{} for _ in range(SIMHASH_BANDS)]  # значение полосы -> [(отпечаток, url)]
+
+    def _keys(self, fingerprint):
+        return [(fingerprint >> (i * self.band_bits)) & self.band_mask for i in range(SIMHASH_BANDS)]
+
+    def find(self, fingerprint, exclude=None):
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            for other, url in band.get(key, ()):
+                if url != exclude and bin(fingerprint ^ other).count('1') <= SIMHASH_DISTANCE:
+                    return url
+        return None
+
+    def add(self, fingerprint, url):
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            band.setdefault(key, []).append((fingerprint, url))
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _ProfiledStage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        stack = self.profiler.stack
+        stack.pop()
+        stats = self.profiler.stats.setdefault(self.name, [0, 0.0, 0.0])  # вызовы, всего, во вложенных
+        stats[0] += 1
+        stats[1] += elapsed
+        if stack:
+            self.profiler.stats.setdefault(stack[-1], [0, 0.0, 0.0])[2] += elapsed
+        return False
+
+class CrawlProfiler:
+    # семплирует стек потока обхода и считает собственное время этапов (fetch, parse, normalize, db, export...)
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stats = {}
+        self.stack = []
+        self.samples = {}
+        self.wall = 0.0
+        self._thread_id = None
+        self._started = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def stage(self, name):
+        return _ProfiledStage(self, name)
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._started = time.perf_counter()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.wall += time.perf_counter() - self._started
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if not stack:
+                continue
+            stages = self.stack[:]  # поток обхода меняет список постоянно, работаем с копией
+            stage = stages[-1] if stages else "other"
+            key = ';'.join([stage] + stack[::-1])
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def write(self, prefix):
+        # prefix.folded - для flamegraph.pl / speedscope, prefix.stages.txt - таблица по этапам
+        with open(prefix + ".folded", 'w', encoding='utf-8') as f:
+            for key, count in sorted(self.samples.items()):
+                f.write(f"{key} {count}\n")
+        own = {name: total - children for name, (calls, total, children) in self.stats.items()}
+        other = max(self.wall - sum(own.values()), 0.0)
+        lines = [f"{'stage':<12} {'calls':>8} {'self, s':>10} {'avg, ms':>10} {'%':>7}"]
+        for name, (calls, total, children) in sorted(self.stats.items(), key=lambda item: -own[item[0]]):
+            lines.append(f"{name:<12} {calls:>8} {own[name]:>10.3f} {own[name] / calls * 1000:>10.3f} " +
+                         f"{own[name] / self.wall * 100 if self.wall else 0:>7.1f}")
+        lines.append(f"{'other':<12} {'':>8} {other:>10.3f} {'':>10} " +
+                     f"{other / self.wall * 100 if self.wall else 0:>7.1f}")
+        lines.append(f"{'total':<12} {'':>8} {self.wall:>10.3f}")
+        with open(prefix + ".stages.txt", 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return '\n'.join(lines)
+
+class ProfiledDatabase:
+    # все обращения к DatabaseManager попадают в этап "db"
+    def __init__(self, db, profiler):
+        self.db = db
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            with self.profiler.stage("db"):
+                return attr(*args, **kwargs)
+        return wrapper
 
 class DatabaseManager:
     def __init__(self, db_name="crawler.db"):
@@ -31,6 +330,25 @@ class DatabaseManager:
                     FOREIGN KEY (parent_url) REFERENCES sitemap(url)
                 )
             ''')
+            # колонки отпечатков для баз, созданных до их появления
+            cursor.execute('PRAGMA table_info(sitemap)')
+            columns = {row[1] for row in cursor.fetchall()}
+            for column, column_type in (("fingerprint", "TEXT"), ("duplicate_of", "TEXT"), ("soft_404", "INTEGER")):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE sitemap ADD COLUMN {column} {column_type}')
+            # все шаги редиректов: нормализованный url -> абсолютный Location как есть (с query),
+            # next_url - нормализованный Location, по нему ищется следующий шаг цепочки
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS redirects (
+                    url TEXT PRIMARY KEY,
+                    status INTEGER,
+                    location TEXT,
+                    next_url TEXT
+                )
+            ''')
+            cursor.execute('PRAGMA table_info(redirects)')
+            if 'next_url' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE redirects ADD COLUMN next_url TEXT')
             conn.commit()
 
     def clear_db(self):
@@ -38,6 +356,7 @@ class DatabaseManager:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM processed_urls')
             cursor.execute('DELETE FROM sitemap')
+            cursor.execute('DELETE FROM redirects')
             conn.commit()
     def add_processed_url(self, url):
         with sqlite3.connect(self.db_name) as conn:
@@ -54,18 +373,53 @@ class DatabaseManager:
     def add_sitemap_node(self, url, status=None, redirected_from=None, parent_url=None):
         with sqlite3.connect(self.db_name) as conn:
             cursor = conn.cursor()
+            # уже существующий узел не затираем: заполняем только пустые колонки
             cursor.execute('''
-                INSERT OR REPLACE INTO sitemap (url, status, redirected_from, parent_url)
+                INSERT INTO sitemap (url, status, redirected_from, parent_url)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    status = COALESCE(sitemap.status, excluded.status),
+                    redirected_from = COALESCE(sitemap.redirected_from, excluded.redirected_from),
+                    parent_url = COALESCE(sitemap.parent_url, excluded.parent_url)
             ''', (url, status, redirected_from, parent_url))
             conn.commit()
 
+    def add_redirect(self, url, status, location, next_url):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO redirects (url, status, location, next_url) VALUES (?, ?, ?, ?)
+            ''', (url, status, location, next_url))
+            conn.commit()
+
+    def get_redirect_chain(self, url):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            chain = []
+            seen = set()
+            while url not in seen:
+                seen.add(url)
+                cursor.execute('SELECT status, location, next_url FROM redirects WHERE url = ?', (url,))
+                row = cursor.fetchone()
+                if not row:
+                    break
+                chain.append({"url": url, "status": row[0], "location": row[1]})
+                url = row[2] or row[1]
+            return chain
+
     def update_node_status(self, url, status):
         with sqlite3.connect(self.db_name) as conn:
             cursor = conn.cursor()
             cursor.execute('UPDATE sitemap SET status = ? WHERE url = ?', (status, url))
             conn.commit()
 
+    def set_node_fingerprint(self, url, fingerprint, duplicate_of=None, soft_404=False):
+        with sqlite3.connect(self.db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE sitemap SET fingerprint = ?, duplicate_of = ?, soft_404 = ? WHERE url = ?',
+                           (f"{fingerprint:016x}", duplicate_of, int(soft_404), url))
+            conn.commit()
+
     def get_sitemap_json(self, root_url):
         with sqlite3.connect(self.db_name) as conn:
             conn.row_factory = sqlite3.Row
@@ -83,6 +437,13 @@ class DatabaseManager:
                     "redirected_from": row["redirected_from"],
                     "links": []
                 }
+                if row["duplicate_of"]:
+                    node["duplicate_of"] = row["duplicate_of"]
+                if row["soft_404"]:
+                    node["soft_404"] = True
+                cursor.execute('SELECT 1 FROM redirects WHERE url = ?', (url,))
+                if cursor.fetchone():
+                    node["redirect_chain"] = self.get_redirect_chain(url)
                 
                 cursor.execute('SELECT url FROM sitemap WHERE parent_url = ?', (url,))
                 child_urls = cursor.fetchall()
@@ -96,19 +457,37 @@ class DatabaseManager:
             return build_node(root_url)
 
 class UrlChecker:
-    def __init__(self, base_url, delay=1, timeout=50, url_count_limit=20, depth_limit=1000, file="sitemap.json"):
+    HEADERS = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+
+    def __init__(self, base_url, delay=1, timeout=50, url_count_limit=20, depth_limit=1000, file="sitemap.json",
+                 pool_size=10, http2=False, dns_ttl=300, client=None, db_name="crawler.db", progress=None,
+                 skip_duplicate_links=False, profiler=None):
         self.base_url = self.normalize_url(base_url)
         self.domain = urlparse(self.base_url).netloc
-        self.db = DatabaseManager()
+        self.db = DatabaseManager(db_name)
+        self.progress = progress  # callback(dict) после каждой проверенной ссылки
         self.delay = delay
         self.timeout = timeout
         self.url_count_limit = url_count_limit
         self.depth_limit = depth_limit
         self.output_file = file
         self.url_count = 0
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        self.redirect_map = {}  # url -> (конечный url, статус первого шага)
+        self.redirect_loops = set()
+        self.fingerprints = FingerprintIndex()
+        self.soft_404_fingerprint = None
+        self.skip_duplicate_links = skip_duplicate_links
+        self.profiler = profiler
+        if profiler:
+            self.db = ProfiledDatabase(self.db, profiler)
+        self.headers = self.HEADERS
+        self.client = client or FetchClient(self.headers, timeout=timeout, pool_size=pool_size,
+                                            http2=http2, dns_ttl=dns_ttl)
+
+    def stage(self, name):
+        return self.profiler.stage(name) if self.profiler else _NULL_STAGE
 
     def normalize_url(self, url):
         if not url.startswith(('http://', 'https://')):
@@ -127,43 +506,121 @@ class UrlChecker:
 
     def process_url(self, url):
         try:
-            response = requests.get(url, headers=self.headers, timeout=self.timeout, 
-                                 allow_redirects=True, stream=True)
-            content = b''
-            for chunk in response.iter_content(1024*10):#читаем блоками по 2кб до 10мб
-                content += chunk
-                if len(content) > 1024*1024*2:
+            chain = []
+            seen = {url}
+            current = url
+            while True:
+                if chain:
+                    hop_url = self.normalize_url(current)
+                    known = self.redirect_map.get(hop_url)
+                    if known:#цепочка уже известна - сразу к конечному url
+                        print(f"Известный редирект: {current} -> {known[0]}")
+                        hop_url = known[0]
+                    if hop_url != url and self.db.is_url_processed(hop_url):
+                        # конечная страница уже проверена или в очереди - повторно не запрашиваем
+                        self._record_redirects(chain, hop_url)
+                        print(f"Конечный URL: {hop_url} - уже в обходе")
+                        return set(), None, hop_url, None
+                    if known:
+                        current = known[0]
+                        if current in seen:
+                            return self._redirect_loop(url, chain)
+                        seen.add(current)
+                with self.stage("fetch"):
+                    status_code, location, content = self.client.fetch(current, timeout=self.timeout)
+                if location is None:
                     break
-            status_code = response.status_code
-            final_url = self.normalize_url(response.url)
+                print(f"Перенаправление: {current} -> {status_code}")
+                chain.append((current, status_code, location))
+                if location in seen or len(chain) >= MAX_REDIRECTS:
+                    return self._redirect_loop(url, chain)
+                seen.add(location)
+                current = location
+            final_url = self.normalize_url(current)
             
-            if response.history: #если редирект
-                for redirect in response.history:
-                    print(f"Перенаправление: {redirect.url} -> {redirect.status_code}")
+            if chain: #если редирект
+                self._record_redirects(chain, final_url)
                 print(f"Конечный URL: {final_url} - Статус: {status_code}")
             else:
                 print(f"Проверка: {url} - Статус: {status_code}")
             
             links = set()
+            fingerprint = None
             if status_code == 200:
-                soup = BeautifulSoup(content, 'html.parser')
-                for link in soup.find_all('a', href=True):
-                    absolute_url = urljoin(final_url, link['href'])
-                    normalized_url = self.normalize_url(absolute_url)
-                    if (self.is_valid_url(normalized_url) and 
-                        normalized_url != final_url and 
-                        normalized_url not in links):
-                        links.add(normalized_url)
+                with self.stage("parse"):
+                    soup = BeautifulSoup(content, 'html.parser')
+                    for link in soup.find_all('a', href=True):
+                        with self.stage("normalize"):
+                            absolute_url = urljoin(final_url, link['href'])
+                            normalized_url = self.normalize_url(absolute_url)
+                            if (self.is_valid_url(normalized_url) and 
+                                normalized_url != final_url and 
+                                normalized_url not in links):
+                                links.add(normalized_url)
+                with self.stage("fingerprint"):
+                    fingerprint = self.page_fingerprint(soup)
             
-            return links, status_code, final_url
-        except requests.RequestException as e:
+            return links, status_code, final_url, fingerprint
+        except FETCH_ERRORS as e:
             print(f"Ошибка при проверке {url}: {e}")
-            return set(), str(e), url
+            return set(), str(e), url, None
+
+    def page_fingerprint(self, soup):
+        for tag in soup(['script', 'style', 'noscript']):
+            tag.decompose()
+        return simhash(soup.get_text(' '))
+
+    def probe_soft_404(self):
+        # заведомо несуществующая страница: если сайт отвечает на нее 200, запоминаем ее отпечаток
+        probe_url = f"{urlparse(self.base_url).scheme}://{self.domain}/{uuid.uuid4().hex}-not-found"
+        try:
+            with self.stage("fetch"):
+                status_code, location, content = self.client.fetch(probe_url, timeout=self.timeout)
+        except FETCH_ERRORS:
+            return
+        if status_code == 200 and location is None:
+            self.soft_404_fingerprint = self.page_fingerprint(BeautifulSoup(content, 'html.parser'))
+            if self.soft_404_fingerprint is not None:
+                print("Сайт отвечает 200 на несуществующие страницы, включено определение soft-404")
+
+    def check_fingerprint(self, url, fingerprint, is_root=False):
+        # возвращает True, если ссылки страницы не нужно обходить; стартовую страницу не помечаем никогда
+        soft_404 = (self.soft_404_fingerprint is not None and
+                    bin(fingerprint ^ self.soft_404_fingerprint).count('1') <= SIMHASH_DISTANCE)
+        duplicate_of = None if is_root else self.fingerprints.find(fingerprint, exclude=url)
+        if duplicate_of is None and self.fingerprints.find(fingerprint) is None:
+            self.fingerprints.add(fingerprint, url)
+        if is_root and soft_404:
+            print("Стартовая страница похожа на ответ для несуществующего адреса, определение soft-404 отключено")
+            self.soft_404_fingerprint = None
+            soft_404 = False
+        if soft_404:
+            print(f"Soft-404: {url}")
+        elif duplicate_of:
+            print(f"Дубликат: {url} ~ {duplicate_of}")
+        self.db.set_node_fingerprint(url, fingerprint, duplicate_of, soft_404)
+        return (soft_404 or duplicate_of is not None) and self.skip_duplicate_links
+
+    def _record_redirects(self, chain, final_url):
+        for hop_url, hop_status, location in chain:
+            hop_url = self.normalize_url(hop_url)
+            self.db.add_redirect(hop_url, hop_status, location, self.normalize_url(location))
+            if hop_url != final_url:
+                self.redirect_map[hop_url] = (final_url, hop_status)
+
+    def _redirect_loop(self, url, chain):
+        for hop_url, hop_status, location in chain:
+            hop_url = self.normalize_url(hop_url)
+            self.db.add_redirect(hop_url, hop_status, location, self.normalize_url(location))
+            self.redirect_loops.add(hop_url)
+        print(f"Циклический редирект: {url}")
+        return set(), "Redirect loop", url, None
 
     def build_sitemap(self):
         queue = deque([(self.base_url, 0)])#(урл,глубина)
         self.db.add_sitemap_node(self.base_url)
         self.db.add_processed_url(self.base_url)
+        self.probe_soft_404()
 
         while queue and self.url_count < self.url_count_limit:
             current_url, depth = queue.popleft()
@@ -171,15 +628,36 @@ class UrlChecker:
             if depth > self.depth_limit:
                 continue
 
+            if current_url in self.redirect_loops:#цикл уже известен, не запрашиваем
+                self.db.update_node_status(current_url, "Redirect loop")
+                continue
+            if current_url in self.redirect_map:#известный редирект, не запрашиваем
+                target, redirect_status = self.redirect_map[current_url]
+                print(f"Известный редирект: {current_url} -> {target}")
+                self.db.update_node_status(current_url, redirect_status)
+                continue
+
             self.url_count += 1
-            links, status, final_url = self.process_url(current_url)
+            links, status, final_url, fingerprint = self.process_url(current_url)
             
             if final_url != current_url:#если редирект
-                self.db.add_sitemap_node(final_url, status, current_url, None)
+                self.db.update_node_status(current_url, self.redirect_map[current_url][1])
+                if status is not None:#конечная страница загружена сейчас
+                    self.db.add_sitemap_node(final_url, status, current_url, None)
+                    self.db.add_processed_url(final_url)
             else:
                 self.db.update_node_status(current_url, status)
 
-            time.sleep(self.delay)
+            if fingerprint is not None and self.check_fingerprint(final_url, fingerprint,
+                                                                  is_root=current_url == self.base_url):
+                links = set()
+
+            if self.progress:
+                self.progress({"url": current_url, "final_url": final_url, "status": status,
+                               "count": self.url_count, "queued": len(queue)})
+
+            with self.stage("sleep"):
+                time.sleep(self.delay)
 
             for link in links:
                 if not self.db.is_url_processed(link):
@@ -193,37 +671,339 @@ class UrlChecker:
         print(f"Параметры: delay={self.delay}s, timeout={self.timeout}s, " +
               f"url_count_limit={self.url_count_limit}, depth_limit={self.depth_limit}")
         
-        self.db.clear_db()
-        self.build_sitemap()
-        sitemap = self.db.get_sitemap_json(self.base_url)
-        
-        with open(self.output_file, 'w', encoding='utf-8') as f:
-            json.dump(sitemap, f, ensure_ascii=False, indent=2)
+        if self.profiler:
+            self.profiler.start()
+        try:
+            self.db.clear_db()
+            self.build_sitemap()
+            with self.stage("export"):
+                sitemap = self.db.get_sitemap_json(self.base_url)
+                with open(self.output_file, 'w', encoding='utf-8') as f:
+                    json.dump(sitemap, f, ensure_ascii=False, indent=2)
+        finally:
+            if self.profiler:
+                self.profiler.stop()
         
         print("\nРезультаты сохранены в "+self.output_file)
+        stats = self.client.stats()
+        print(f"Соединения: запросов={stats['requests']}, новых соединений={stats['connections']}, " +
+              f"переиспользовано={stats['reused']}, хостов в DNS-кэше={stats['dns_cached_hosts']}, " +
+              f"http2={stats['http2']}")
         return sitemap
 
+class CrawlJob:
+    EVENTS_KEEP = 1000  # в памяти держим только последние события, остальное - счетчики
+
+    def __init__(self, params, jobs_dir):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.state = "queued"
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.db_name = os.path.join(jobs_dir, self.id + ".db")
+        self.output_file = os.path.join(jobs_dir, self.id + ".json")
+        self.base_url = None
+        self.events = deque(maxlen=self.EVENTS_KEEP)
+        self.event_count = 0
+        self.checked = 0
+        self.changed = threading.Condition()
+
+    def add_event(self, event, state=None):
+        # состояние меняем под тем же замком, что и событие, чтобы поток событий не закончился раньше него
+        with self.changed:
+            if state is not None:
+                self.state = state
+            self.events.append(event)
+            self.event_count += 1
+            if "url" in event:
+                self.checked += 1
+            self.changed.notify_all()
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def info(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "params": self.params,
+            "base_url": self.base_url,
+            "checked": self.checked,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+def _json_bool(value):
+    # bool("false") == True, поэтому принимаем только настоящие true/false из JSON
+    if not isinstance(value, bool):
+        raise ValueError("expected true or false")
+    return value
+
+def _json_number(cast, positive=False):
+    # json.loads пропускает NaN, Infinity и 1e400 (inf) - такие значения и отрицательные отклоняем
+    def convert(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("expected a number")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError("expected a finite number")
+        if value < 0 or (positive and value == 0):
+            raise ValueError("expected a positive number" if positive else "expected a non-negative number")
+        return cast(value)
+    return convert
+
+class CrawlService:
+    JOB_PARAMS = {"url": str, "delay": _json_number(float), "timeout": _json_number(float, positive=True),
+                  "url_count_limit": _json_number(int), "depth_limit": _json_number(int),
+                  "skip_duplicate_links": _json_bool}
+
+    def __init__(self, workers=4, jobs_dir="jobs", pool_size=10, http2=False, dns_ttl=300, keep_jobs=100):
+        self.jobs_dir = jobs_dir
+        self.keep_jobs = keep_jobs  # сколько завершенных задач (и их файлов) хранить
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.defaults = {"delay": 1, "timeout": 50, "url_count_limit": 1000000, "depth_limit": 1000}
+        # один прогретый клиент (пул соединений и DNS-кэш) на все задачи
+        self.client = FetchClient(UrlChecker.HEADERS, timeout=self.defaults["timeout"], pool_size=pool_size * workers,
+                                  http2=http2, dns_ttl=dns_ttl)
+
+    def submit(self, params):
+        if not isinstance(params, dict) or not params.get("url"):
+            raise ValueError("url is required")
+        unknown = set(params) - set(self.JOB_PARAMS)
+        if unknown:
+            raise ValueError("unknown parameters: " + ", ".join(sorted(unknown)))
+        converted = {}
+        for key, value in params.items():
+            try:
+                converted[key] = self.JOB_PARAMS[key](value)
+            except (ValueError, TypeError, OverflowError) as e:
+                raise ValueError(f"{key}: {e}")
+        params = {**self.defaults, **converted}
+        job = CrawlJob(params, self.jobs_dir)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job)
+        return job
+
+    def _run(self, job):
+        job.add_event({"state": "running"}, state="running")
+        try:
+            params = dict(job.params)
+            checker = UrlChecker(params.pop("url"), file=job.output_file, client=self.client,
+                                 db_name=job.db_name, progress=job.add_event, **params)
+            job.base_url = checker.base_url
+            checker.start()
+            state = "done"
+        except Exception as e:
+            state = "failed"
+            job.error = str(e)
+        job.finished = time.time()
+        job.add_event({"state": state, "error": job.error}, state=state)
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            finished = sorted((job for job in self.jobs.values() if not job.active), key=lambda job: job.finished)
+            expired = finished[:max(len(finished) - self.keep_jobs, 0)]
+            for job in expired:
+                del self.jobs[job.id]
+        for job in expired:
+            self._remove_files(job)
+
+    def _remove_files(self, job):
+        for path in (job.db_name, job.output_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def delete(self, job_id):
+        # возвращает False, если задачи нет; незавершенную задачу удалить нельзя
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if job.active:
+                raise RuntimeError("job is not finished")
+            del self.jobs[job_id]
+        self._remove_files(job)
+        return True
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return [job.info() for job in self.jobs.values()]
+
+    def subtree(self, job, url=None):
+        if job.base_url is None or not os.path.exists(job.db_name):
+            return None
+        return DatabaseManager(job.db_name).get_sitemap_json(url or job.base_url)
+
+class CrawlRequestHandler(BaseHTTPRequestHandler):
+    # POST /jobs                      - новая задача {"url": ..., "delay": ..., ...}
+    # GET  /jobs                      - список задач
+    # GET  /jobs/<id>                 - состояние задачи
+    # GET  /jobs/<id>/events          - поток прогресса (NDJSON) до завершения задачи
+    # GET  /jobs/<id>/result[?url=..] - карта сайта или поддерево от url
+    # DELETE /jobs/<id>               - удалить завершенную задачу и ее файлы
+    # GET  /stats                     - статистика соединений
+    service = None
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        parsed = urlparse(self.path)
+        parts = [p for p in parsed.path.split('/') if p]
+        return parts, parse_qs(parsed.query)
+
+    def do_POST(self):
+        parts, _ = self._route()
+        if parts != ['jobs']:
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = self.service.submit(json.loads(self.rfile.read(length) or b'{}'))
+        except (ValueError, TypeError) as e:
+            return self._send_json({"error": str(e)}, 400)
+        self._send_json(job.info(), 202)
+
+    def do_DELETE(self):
+        parts, _ = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._send_json({"error": "not found"}, 404)
+        try:
+            deleted = self.service.delete(parts[1])
+        except RuntimeError as e:
+            return self._send_json({"error": str(e)}, 409)
+        if not deleted:
+            return self._send_json({"error": "job not found"}, 404)
+        self._send_json({"deleted": parts[1]})
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ['jobs']:
+            return self._send_json(self.service.list())
+        if parts == ['stats']:
+            return self._send_json(self.service.client.stats())
+        if len(parts) < 2 or parts[0] != 'jobs':
+            return self._send_json({"error": "not found"}, 404)
+        job = self.service.get(parts[1])
+        if job is None:
+            return self._send_json({"error": "job not found"}, 404)
+        if len(parts) == 2:
+            return self._send_json(job.info())
+        if parts[2] == 'events':
+            return self._stream_events(job)
+        if parts[2] == 'result':
+            tree = self.service.subtree(job, query.get('url', [None])[0])
+            if tree is None:
+                return self._send_json({"error": "no data"}, 404)
+            return self._send_json(tree)
+        self._send_json({"error": "not found"}, 404)
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        sent = 0  # номер следующего события; вытесненные из job.events пропускаются
+        while True:
+            with job.changed:
+                while sent == job.event_count and job.active:
+                    job.changed.wait(timeout=15)
+                new = min(job.event_count - sent, len(job.events))
+                events = list(job.events)[len(job.events) - new:]
+                sent = job.event_count
+                finished = not job.active
+            for event in events:
+                self.wfile.write(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            if finished:
+                break
+        self.close_connection = True
+
+def serve(address, workers=4, jobs_dir="jobs", pool_size=10, http2=False, dns_ttl=300, keep_jobs=100):
+    host, _, port = address.rpartition(':')
+    service = CrawlService(workers=workers, jobs_dir=jobs_dir, pool_size=pool_size, http2=http2, dns_ttl=dns_ttl,
+                           keep_jobs=keep_jobs)
+    handler = type('Handler', (CrawlRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+    print(f"Сервис запущен на http://{host or '127.0.0.1'}:{port}, воркеров: {workers}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.executor.shutdown(wait=False, cancel_futures=True)
+
 def main():
     parser = argparse.ArgumentParser(description='Проверка ссылок на сайте')
-    parser.add_argument('url', help='URL сайта для проверки')
+    parser.add_argument('url', nargs='?', help='URL сайта для проверки')
     parser.add_argument('--delay', type=float, default=1, help='Задержка между запросами (секунды)')
     parser.add_argument('--timeout', type=float, default=50, help='Таймаут запроса (секунды)')
     parser.add_argument('--url-count-limit', type=int, default=1000000, help='Лимит URL для проверки')
     parser.add_argument('--depth-limit', type=int, default=1000, help='Максимальная глубина проверки')
     parser.add_argument('--output', default="sitemap.json", help='Файл')
+    parser.add_argument('--pool-size', type=int, default=10, help='Размер пула keep-alive соединений')
+    parser.add_argument('--dns-ttl', type=float, default=300, help='Время жизни DNS-кэша (секунды), 0 - отключить')
+    parser.add_argument('--http2', action='store_true', help='Использовать HTTP/2 (нужен httpx[http2])')
+    parser.add_argument('--skip-duplicate-links', action='store_true',
+                        help='Не обходить ссылки со страниц-дубликатов и soft-404')
+    parser.add_argument('--profile', action='store_true',
+                        help='Профилировать обход: PREFIX.folded (flamegraph) и PREFIX.stages.txt (этапы)')
+    parser.add_argument('--profile-prefix', default='profile', metavar='PREFIX',
+                        help='Префикс файлов профиля')
+    parser.add_argument('--profile-interval', type=float, default=5,
+                        help='Интервал семплирования стека при --profile (миллисекунды)')
+    parser.add_argument('--serve', metavar='HOST:PORT', help='Запустить как сервис с HTTP API, например 127.0.0.1:8080')
+    parser.add_argument('--workers', type=int, default=4, help='Число одновременных задач в режиме сервиса')
+    parser.add_argument('--jobs-dir', default="jobs", help='Каталог для баз и результатов задач сервиса')
+    parser.add_argument('--keep-jobs', type=int, default=100,
+                        help='Сколько завершенных задач хранить в режиме сервиса (старые удаляются вместе с файлами)')
     
     args = parser.parse_args()
 
+    if args.serve:
+        serve(args.serve, workers=args.workers, jobs_dir=args.jobs_dir, pool_size=args.pool_size,
+              http2=args.http2, dns_ttl=args.dns_ttl, keep_jobs=args.keep_jobs)
+        return
+    if not args.url:
+        parser.error('нужно указать url или --serve')
+
+    profiler = CrawlProfiler(args.profile_interval / 1000) if args.profile else None
     checker = UrlChecker(
         args.url,
         delay=args.delay,
         timeout=args.timeout,
         url_count_limit=args.url_count_limit,
         depth_limit=args.depth_limit,
-        file=args.output
+        file=args.output,
+        pool_size=args.pool_size,
+        http2=args.http2,
+        dns_ttl=args.dns_ttl,
+        skip_duplicate_links=args.skip_duplicate_links,
+        profiler=profiler
     )
 
     checker.start()
+    if profiler:
+        print("\n" + profiler.write(args.profile_prefix))
+        print(f"Профиль сохранен в {args.profile_prefix}.folded и {args.profile_prefix}.stages.txt")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file